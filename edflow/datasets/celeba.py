@@ -1,12 +1,88 @@
-import sys, os, tarfile, pickle
+import sys, os, io, tarfile, pickle
+from functools import lru_cache
 from pathlib import Path
 import numpy as np
+import pandas as pd
 from tqdm import tqdm, trange
 import urllib
 from PIL import Image
 
 import edflow.datasets.utils as edu
 
+try:
+    from turbojpeg import TurboJPEG, TJPF_RGB, TJFLAG_FASTDCT, TJFLAG_FASTUPSAMPLE
+
+    __COULD_HAVE_TURBOJPEG__ = True
+except ImportError:
+    __COULD_HAVE_TURBOJPEG__ = False
+
+_TURBOJPEG = None
+
+
+def _get_turbojpeg():
+    """Per process instance of :class:`TurboJPEG` or ``None`` if it is not
+    available."""
+    global _TURBOJPEG, __COULD_HAVE_TURBOJPEG__
+    if _TURBOJPEG is None and __COULD_HAVE_TURBOJPEG__:
+        try:
+            _TURBOJPEG = TurboJPEG()
+        except (OSError, RuntimeError):
+            # python module is installed but libturbojpeg could not be found
+            __COULD_HAVE_TURBOJPEG__ = False
+    return _TURBOJPEG
+
+
+try:
+    import numba
+
+    __COULD_HAVE_NUMBA__ = True
+except ImportError:
+    __COULD_HAVE_NUMBA__ = False
+
+if __COULD_HAVE_NUMBA__:
+    # both kernels loop over the flattened image such that the loop
+    # vectorizes. They are separate functions because numba's cache does not
+    # distinguish compile options of the same function.
+
+    @numba.njit(fastmath=True, cache=True)
+    def _normalize_kernel(u8, out):
+        scale = np.float32(1.0 / 127.5)
+        one = np.float32(1.0)
+        for i in range(u8.shape[0]):
+            out[i] = np.float32(u8[i]) * scale - one
+
+    # single images are normalized inside loader worker processes, which
+    # already use all cores, so only batches use the parallel kernel
+    @numba.njit(parallel=True, fastmath=True, cache=True)
+    def _normalize_kernel_parallel(u8, out):
+        scale = np.float32(1.0 / 127.5)
+        one = np.float32(1.0)
+        for i in numba.prange(u8.shape[0]):
+            out[i] = np.float32(u8[i]) * scale - one
+
+
+def _read_bytes(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+# recently read files are kept in memory, separately for each worker process
+_read_bytes_cached = lru_cache(maxsize=256)(_read_bytes)
+
+
+def _normalize(image, parallel=False):
+    """Map uint8 values in [0, 255] to float32 values in [-1, 1] without
+    going through a float64 temporary. With numba, ``parallel`` distributes
+    the work over numba's threads (see ``NUMBA_NUM_THREADS``)."""
+    out = np.empty(image.shape, dtype=np.float32)
+    if __COULD_HAVE_NUMBA__:
+        kernel = _normalize_kernel_parallel if parallel else _normalize_kernel
+        kernel(np.ascontiguousarray(image).reshape(-1), out.reshape(-1))
+        return out
+    np.multiply(image, np.float32(1.0 / 127.5), out=out, casting="unsafe")
+    out -= np.float32(1.0)
+    return out
+
 
 class CelebA(edu.DatasetMixin):
     NAME = "CelebA"
@@ -17,16 +93,21 @@ class CelebA(edu.DatasetMixin):
         "identity_CelebA.txt",
         "list_attr_celeba.txt",
     ]
+    PARTITIONS = {"train": 0, "val": 1, "test": 2}
 
     def __init__(self, config=None):
         self.config = config or dict()
         self.logger = edu.get_logger(self)
         self._prepare()
         self._load()
+        if self._get_option("cache_decoded", False):
+            self._prepare_cache()
 
     def _prepare(self):
         self.root = edu.get_root(self.NAME)
         self._data_path = Path(self.root).joinpath("data.p")
+        self._split_indices_path = Path(self.root).joinpath("split_indices.npz")
+        self._data = None
         if not edu.is_prepared(self.root):
             # prep
             self.logger.info("Preparing dataset {} in {}".format(self.NAME, self.root))
@@ -43,38 +124,121 @@ class CelebA(edu.DatasetMixin):
             for v in self.FILES[1:]:
                 local_files[v] = edu.prompt_download(v, self.URL, root)
 
-            with open(os.path.join(self.root, "list_eval_partition.txt"), "r") as f:
-                list_eval_partition = f.read().splitlines()
-                fnames = [s[:10] for s in list_eval_partition]
-                list_eval_partition = np.array(
-                    [int(s[11:]) for s in list_eval_partition]
-                )
-            with open(os.path.join(self.root, "list_attr_celeba.txt"), "r") as f:
-                list_attr_celeba = f.read().splitlines()
-                attribute_descriptions = list_attr_celeba[1]
-                list_attr_celeba = list_attr_celeba[2:]
-                assert len(list_attr_celeba) == len(list_eval_partition)
-                assert [s[:10] for s in list_attr_celeba] == fnames
-                list_attr_celeba = np.array(
-                    [[int(x) for x in s[11:].split()] for s in list_attr_celeba]
-                )
-            with open(os.path.join(self.root, "identity_CelebA.txt"), "r") as f:
-                identity_celeba = f.read().splitlines()
-                assert [s[:10] for s in identity_celeba] == fnames
-                identity_celeba = np.array([int(s[11:]) for s in identity_celeba])
+            df_partition = pd.read_csv(
+                os.path.join(self.root, "list_eval_partition.txt"),
+                sep=r"\s+",
+                header=None,
+                names=["image_id", "partition"],
+                dtype={"image_id": str, "partition": np.int8},
+                engine="c",
+            )
+            fnames = df_partition["image_id"].to_numpy()
+            list_eval_partition = df_partition["partition"].to_numpy()
+            attr_fnames, attribute_names, list_attr_celeba = self._read_attributes(
+                os.path.join(self.root, "list_attr_celeba.txt")
+            )
+            assert len(list_attr_celeba) == len(list_eval_partition)
+            assert np.array_equal(attr_fnames, fnames)
+            df_identity_celeba = pd.read_csv(
+                os.path.join(self.root, "identity_CelebA.txt"),
+                sep=r"\s+",
+                header=None,
+                names=["image_id", "identity"],
+                dtype={"image_id": str},
+                engine="c",
+            )
+            assert np.array_equal(df_identity_celeba["image_id"].to_numpy(), fnames)
+            identity_celeba = df_identity_celeba["identity"].to_numpy()
 
             data = {
-                "fname": np.array(
-                    [os.path.join("img_align_celeba/{}".format(s)) for s in fnames]
-                ),
-                "partition": list_eval_partition,
-                "identity": identity_celeba,
-                "attributes": list_attr_celeba,
+                "fname": np.char.add("img_align_celeba/", fnames.astype(str)),
+                # compact dtypes: partitions are in {0, 1, 2}, identities in
+                # [1, 10177] and attributes in {-1, 1}
+                "partition": list_eval_partition.astype(np.int8, copy=False),
+                "identity": identity_celeba.astype(np.int16, copy=False),
+                "attributes": list_attr_celeba.astype(np.int8, copy=False),
             }
-            with open(self._data_path, "wb") as f:
-                pickle.dump(data, f)
+            for k, v in data.items():
+                np.save(str(self._get_column_path(k)), v)
+            self._write_split_indices(data["partition"])
             edu.mark_prepared(self.root)
 
+    def _read_attributes(self, path):
+        """Parse the attribute file, which starts with the number of images
+        and a line of attribute names, followed by one line per image with
+        its filename and a value of -1 or 1 for each attribute.
+
+        Returns
+        -------
+        tuple
+            Filenames, attribute names and the int8 attribute matrix.
+        """
+        with open(path, "r") as f:
+            f.readline()  # number of images
+            attribute_names = f.readline().split()
+            # pandas' C parser reads filenames and values in a single pass
+            # and is faster than np.loadtxt, which is pure Python for numpy
+            # versions before 1.23
+            dtype = dict((name, np.int8) for name in attribute_names)
+            dtype["image_id"] = str
+            df_attr_celeba = pd.read_csv(
+                f,
+                sep=r"\s+",
+                header=None,
+                names=["image_id"] + attribute_names,
+                dtype=dtype,
+                engine="c",
+            )
+        fnames = df_attr_celeba["image_id"].to_numpy()
+        attributes = df_attr_celeba[attribute_names].to_numpy(dtype=np.int8)
+        return fnames, attribute_names, attributes
+
+    def _write_split_indices(self, partition):
+        """Store the sorted indices of each split such that loading a split
+        does not require a scan over all partitions."""
+        split_indices = dict(
+            (split, np.where(partition == k)[0].astype(np.int32))
+            for split, k in self.PARTITIONS.items()
+        )
+        np.savez(str(self._split_indices_path), **split_indices)
+
+    def _get_column_path(self, key):
+        return Path(self.root).joinpath("{}.npy".format(key))
+
+    def _read_columns(self, keys, indices=None):
+        """Read the label arrays ``keys``, optionally only at ``indices``.
+        Columns are memory mapped from ``<key>.npy`` such that only the
+        accessed rows are read. Datasets prepared with an older version
+        fall back to ``data.p``."""
+        if all(self._get_column_path(k).exists() for k in keys):
+            data = dict(
+                (k, np.load(str(self._get_column_path(k)), mmap_mode="r")) for k in keys
+            )
+            if indices is None:
+                return data
+            return {k: v[indices] for k, v in data.items()}
+
+        if self._data is None:
+            with open(self._data_path, "rb") as f:
+                self._data = pickle.load(f)
+        if indices is None:
+            return {k: self._data[k] for k in keys}
+        return {k: self._data[k][indices] for k in keys}
+
+    def _get_option(self, key, default=None):
+        return self.config.get(self.NAME, dict()).get(key, default)
+
+    def _get_size(self):
+        """Target size of images as ``(height, width)`` or ``None`` to keep
+        the original size. Can be specified as an int or a pair in
+        ``config["CelebA"]["size"]``."""
+        size = self._get_option("size")
+        if size is None:
+            return None
+        if isinstance(size, int):
+            size = (size, size)
+        return tuple(int(s) for s in size)
+
     def _get_split(self):
         split = (
             "test" if self.config.get("test_mode", False) else "train"
@@ -84,44 +248,180 @@ class CelebA(edu.DatasetMixin):
         return split
 
     def _load(self):
-        with open(self._data_path, "rb") as f:
-            self._data = pickle.load(f)
         split = self._get_split()
-        assert split in ["train", "test", "val"]
+        assert split in self.PARTITIONS
         self.logger.info("Using split: {}".format(split))
-        if split == "train":
-            self.split_indices = np.where(self._data["partition"] == 0)[0]
-        elif split == "val":
-            self.split_indices = np.where(self._data["partition"] == 1)[0]
-        elif split == "test":
-            self.split_indices = np.where(self._data["partition"] == 2)[0]
-        self.labels = {
-            "fname": self._data["fname"][self.split_indices],
-            "partition": self._data["partition"][self.split_indices],
-            "identity": self._data["identity"][self.split_indices],
-            "attributes": self._data["attributes"][self.split_indices],
-        }
+        if self._split_indices_path.exists():
+            with np.load(str(self._split_indices_path)) as split_indices:
+                self.split_indices = split_indices[split]
+        else:
+            partition = self._read_columns(["partition"])["partition"]
+            self.split_indices = np.where(partition == self.PARTITIONS[split])[0]
+        self.labels = self._read_columns(
+            ["fname", "partition", "identity", "attributes"], self.split_indices
+        )
         self._length = self.labels["fname"].shape[0]
+        self._image_paths = self._get_image_paths(self.labels["fname"])
+        self._size = self._get_size()
+        self._cache_files = self._get_option("cache_files", False)
+        self._mmap = None
+        self._shuffle_buffer = None
+        buffer_size = self._get_option("shuffle_buffer_size")
+        if buffer_size and not self.config.get("test_mode", False):
+            # evaluation stores outputs by index_ and expects each example
+            # exactly once, so the buffer is only used for training
+            self._shuffle_buffer = edu.ShuffleBuffer(
+                self._load_decoded_example,
+                self._length,
+                buffer_size,
+                fetch_size=self._get_option("shuffle_fetch_size", 1024),
+            )
+
+    def _get_cache_path(self):
+        size = "full" if self._size is None else "{}x{}".format(*self._size)
+        return Path(self.root).joinpath("images_{}.u8.npy".format(size))
+
+    def _prepare_cache(self):
+        """Decode all images once into a uint8 array of shape ``(N, H, W, 3)``
+        stored as ``.npy`` file in the dataset root and memory map it. Enabled
+        with ``config["CelebA"]["cache_decoded"]``."""
+        cache_path = self._get_cache_path()
+        if not cache_path.exists():
+            self.logger.info("Caching decoded images in {}".format(cache_path))
+            paths = self._get_image_paths(self._read_columns(["fname"])["fname"])
+            first = self._decode_image(self._open_image(paths[0], cached=False))
+            tmp_path = cache_path.with_suffix(".tmp")
+            images = np.lib.format.open_memmap(
+                tmp_path, mode="w+", dtype=np.uint8, shape=(len(paths),) + first.shape,
+            )
+            for i, path in enumerate(tqdm(paths, desc="Caching")):
+                images[i] = self._decode_image(self._open_image(path, cached=False))
+            images.flush()
+            del images
+            os.replace(tmp_path, cache_path)
+        self._mmap = np.load(cache_path, mmap_mode="r")
+
+    def _get_image_paths(self, fnames):
+        """Join the root with relative filenames into a fixed width unicode
+        array of absolute paths at once."""
+        return np.char.add(os.path.join(self.root, ""), fnames)
+
+    def _open_image(self, path, cached=True):
+        """Open the image at ``path``. Its content is kept in memory for
+        repeated reads if ``cached`` and ``config["CelebA"]["cache_files"]``."""
+        if cached and self._cache_files:
+            content = _read_bytes_cached(str(path))
+        else:
+            content = _read_bytes(str(path))
+        turbojpeg = _get_turbojpeg() if self._size is None else None
+        if turbojpeg is not None:
+            # decodes directly into a RGB uint8 array
+            return turbojpeg.decode(
+                content,
+                pixel_format=TJPF_RGB,
+                flags=TJFLAG_FASTDCT | TJFLAG_FASTUPSAMPLE,
+            )
+        image = Image.open(io.BytesIO(content))
+        if self._size is not None:
+            h, w = self._size
+            draft_size = (w, h)
+        else:
+            draft_size = image.size
+        # let libjpeg decode straight to RGB and downscale during decoding
+        image.draft("RGB", draft_size)
+        return image
 
     def _load_example(self, i):
         example = dict()
         for k in self.labels:
             example[k] = self.labels[k][i]
-        example["image"] = Image.open(os.path.join(self.root, example["fname"]))
-        if not example["image"].mode == "RGB":
-            example["image"] = example["image"].convert("RGB")
-        example["image"] = np.array(example["image"])
+        if self._mmap is not None:
+            # copy only the requested image out of the cache
+            example["image"] = np.array(self._mmap[self.split_indices[i]])
+        else:
+            # decoding is deferred until _preprocess_example
+            example["image"] = self._open_image(self._image_paths[i])
+        return example
+
+    def _load_decoded_example(self, i):
+        # the shuffle buffer holds decoded arrays, such that drawing from it
+        # only needs to normalize
+        example = self._load_example(i)
+        example["image"] = self._decode_image(example["image"])
+        example["buffer_index_"] = i
         return example
 
+    def _decode_image(self, image):
+        """Convert a loaded PIL image to a RGB uint8 array of target size.
+        Arrays coming from the cache or from TurboJPEG are already decoded."""
+        if isinstance(image, np.ndarray):
+            return image
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        if self._size is not None:
+            h, w = self._size
+            if image.size != (w, h):
+                image = image.resize((w, h), resample=Image.BICUBIC)
+        return np.asarray(image)
+
     def _preprocess_example(self, example):
-        example["image"] = example["image"] / 127.5 - 1.0
-        example["image"] = example["image"].astype(np.float32)
+        example["image"] = _normalize(self._decode_image(example["image"]))
 
     def get_example(self, i):
-        example = self._load_example(i)
+        if self._shuffle_buffer is not None:
+            # with config["CelebA"]["shuffle_buffer_size"], i is ignored and a
+            # random example is drawn from chunks of sequentially read files.
+            # Its index is stored in buffer_index_.
+            example = self._shuffle_buffer.get()
+        else:
+            example = self._load_example(i)
         self._preprocess_example(example)
         return example
 
+    def get_batch(self, indices):
+        """Load the examples at ``indices`` as a single batch. Images are
+        collected into one uint8 array of shape ``(N, H, W, 3)`` and
+        normalized at once. If numba is installed, normalization runs on
+        multiple threads. When calling this from several processes, limit
+        them with ``NUMBA_NUM_THREADS``.
+
+        Parameters
+        ----------
+        indices : list or np.ndarray
+            Indices of the examples to load.
+
+        Returns
+        -------
+        dict
+            The same keys as :meth:`get_example` with values stacked along
+            the first axis.
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        if len(indices) == 0:
+            raise ValueError("get_batch requires at least one index.")
+        batch = dict((k, v[indices]) for k, v in self.labels.items())
+        if self._mmap is not None:
+            raw = self._mmap[self.split_indices[indices]]
+        else:
+            raw = None
+            for k, path in enumerate(self._image_paths[indices]):
+                image = self._decode_image(self._open_image(path))
+                if raw is None:
+                    raw = np.empty((len(indices),) + image.shape, dtype=np.uint8)
+                raw[k] = image
+        batch["image"] = _normalize(raw, parallel=True)
+        return batch
+
+    def __getitem__(self, i):
+        ret_dict = super().__getitem__(i)
+        if self._shuffle_buffer is not None:
+            # index_ and labels_ refer to the requested index, but the
+            # example drawn from the buffer is a different one
+            for d in ret_dict if isinstance(ret_dict, list) else [ret_dict]:
+                d["index_"] = d.pop("buffer_index_")
+                self._maybe_append_labels(d, d["index_"])
+        return ret_dict
+
     def __len__(self):
         return self._length
 
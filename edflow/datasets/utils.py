@@ -157,3 +157,68 @@ def quadratic_crop(x, bbox, alpha=1.0):
     xmin = int(center[0] - l / 2)
     ymin = int(center[1] - l / 2)
     return np.array(x[ymin : ymin + l, xmin : xmin + l, ...])
+
+
+class ShuffleBuffer(object):
+    """Approximately random access to examples through sequential reads.
+
+    Instead of loading examples at random indices, contiguous chunks of
+    ``fetch_size`` examples are loaded in a random chunk order into a buffer
+    of up to ``buffer_size`` examples, from which examples are then drawn at
+    random. This turns random reads into sequential ones which benefit from
+    filesystem readahead.
+    """
+
+    def __init__(self, load_fn, length, buffer_size, fetch_size=1024, seed=None):
+        """
+        Parameters
+        ----------
+        load_fn : Callable
+            Returns the example at the given index.
+        length : int
+            Number of examples available through :attr:`load_fn`.
+        buffer_size : int
+            Maximum number of examples held in memory. Each worker process
+            of a multiprocess loader keeps its own buffer.
+        fetch_size : int
+            Number of contiguous examples loaded at once.
+        seed : int
+            Seed for the random chunk order and draws. It is combined with
+            the process id, such that forked workers draw different
+            examples, which also means that sequences are only reproducible
+            within the same process.
+        """
+        self.load_fn = load_fn
+        self.length = length
+        self.buffer_size = max(1, buffer_size)
+        self.fetch_size = max(1, min(fetch_size, self.buffer_size))
+        self.refill_threshold = self.buffer_size - self.fetch_size + 1
+        self.seed = seed
+        self._pid = None
+
+    def _reset(self):
+        # workers forked from the same parent must not share buffer and
+        # random state
+        self._pid = os.getpid()
+        seed = None if self.seed is None else [self.seed, self._pid]
+        self._rng = np.random.RandomState(seed)
+        self._chunk_starts = list()
+        self._buffer = list()
+
+    def _fetch(self):
+        if len(self._chunk_starts) == 0:
+            self._chunk_starts = list(np.arange(0, self.length, self.fetch_size))
+            self._rng.shuffle(self._chunk_starts)
+        start = self._chunk_starts.pop()
+        stop = min(start + self.fetch_size, self.length)
+        self._buffer += [self.load_fn(i) for i in range(start, stop)]
+
+    def get(self):
+        """Draw a random example from the buffer, refilling it if needed."""
+        if self._pid != os.getpid():
+            self._reset()
+        while len(self._buffer) < min(self.refill_threshold, self.length):
+            self._fetch()
+        k = self._rng.randint(len(self._buffer))
+        self._buffer[k], self._buffer[-1] = self._buffer[-1], self._buffer[k]
+        return self._buffer.pop()
@@ -1,10 +1,22 @@
 import signal, sys, math
+from functools import partial
 from tqdm import tqdm, trange
 
 from edflow.custom_logging import get_logger
 from edflow.util import walk
 
 
+def _copy_containers(nested):
+    """Copy nested lists and dicts but not their leaves. Gives the same
+    result as ``walk(nested, lambda val: val)`` without calling a function
+    for each leaf."""
+    if isinstance(nested, dict):
+        return dict((k, _copy_containers(v)) for k, v in nested.items())
+    if isinstance(nested, list):
+        return [_copy_containers(v) for v in nested]
+    return nested
+
+
 class ShutdownRequest(Exception):
     """Raised when we receive a SIGTERM signal to shut down. Allows hooks to
     perform final actions such as writing a last checkpoint."""
@@ -51,6 +63,11 @@ class PyHookedModelIterator(object):
         self.config = config
         self.root = root
 
+        # resolved once as they do not change during iteration
+        self._is_test = bool(config.get("test_mode", False))
+        self._val_freq = config.get("val_freq", config.get("log_freq", -1))
+        self._num_steps_cap = config.get("num_steps", float("inf"))
+
         self.model = model
         self.datasets = datasets
         # backwards compatibility
@@ -73,6 +90,7 @@ class PyHookedModelIterator(object):
         self._batch_step = 0
         self._epoch_step = 0
         self._split = None
+        self._split_active = dict()
 
     def get_split(self, *args, **kwargs):
         """Get the current split that is processed."""
@@ -101,14 +119,14 @@ class PyHookedModelIterator(object):
         self.set_global_step(0)
 
     def increment_global_step(self, *args, **kwargs):
-        if not self.config.get("test_mode", False):
+        if not self._is_test:
             self._global_step += 1
         return self._global_step
 
     def make_feeds(self, batch):
-        # copy of batches
-        feeds = walk(batch, lambda val: val)
-        return feeds
+        # copy of batches, such that hooks modifying feeds in place do not
+        # modify the batch
+        return _copy_containers(batch)
 
     def _handle_sigterm(self, signum, frame):
         e = ShutdownRequest()
@@ -146,17 +164,39 @@ class PyHookedModelIterator(object):
         """
 
         step_ops = self.step_ops()
-        epoch_hooks_only = self.config.get("test_mode", False)
+        epoch_hooks_only = self._is_test
+        num_steps = self._num_steps_cap
 
         pos = self.bar_pos
         base = self.desc + " - " if self.desc != "" else ""
         desc_epoch = base + "Epoch"
         desc_batch = base + "Batch"
 
-        # TODO use val freq
-        validation_frequency = self.config.get(
-            "val_freq", self.config.get("log_freq", -1)
+        fast_progress = self.config.get("fast_progress", True)
+
+        def bar_kwargs(total):
+            if fast_progress:
+                # refresh batch bars at most once per second and determine
+                # the terminal width only once per bar
+                return dict(
+                    dynamic_ncols=False,
+                    mininterval=1.0,
+                    miniters=max(1, total // 1000),
+                )
+            return dict(dynamic_ncols=True)
+
+        # lazily evaluated ops on each split, created once instead of per step
+        split_ops = dict(
+            (split, partial(self._split_op, batches, split, step_ops))
+            for split in batches
+        )
+        epoch_split_ops = dict(
+            (split, partial(self._split_op, batches, split, step_ops, True))
+            for split in batches
         )
+
+        # TODO use val freq
+        validation_frequency = self._val_freq
         batches_per_epoch = 0 if epoch_hooks_only else len(batches["train"])
         if "max_batches_per_epoch" in self.config:
             batches_per_epoch = min(
@@ -185,39 +225,28 @@ class PyHookedModelIterator(object):
             batches["train"].reset()
             self.run_hooks(epoch_step, before=True)
 
+            # stop early in the epoch that reaches num_steps instead of
+            # checking the global step after every batch
+            remaining_steps = max(0, num_steps - self.get_global_step())
+            stop_step = int(min(batches_per_epoch, start_step + remaining_steps))
             for batch_step in trange(
                 start_step,
-                batches_per_epoch,
+                stop_step,
                 initial=start_step,
-                total=batches_per_epoch,
+                total=stop_step,
                 desc=desc_batch,
                 position=pos + 1,
-                dynamic_ncols=True,
                 leave=False,
+                **bar_kwargs(stop_step)
             ):
                 self._batch_step = batch_step
 
-                def lazy_split_op(split):
-                    def split_op():
-                        self._split = split
-                        batch = next(batches[split])
-                        feeds = self.make_feeds(batch)
-                        fetches = step_ops
-                        self.run_hooks(batch_step, fetches, feeds, batch, before=True)
-                        return self.run(fetches, feed_dict=feeds)
-
-                    return split_op
-
                 results = {"global_step": self.get_global_step()}
-                for split in batches:
-                    results[split] = lazy_split_op(split)
+                results.update(split_ops)
                 self.run_hooks(batch_step, results=results, before=False)
                 del results
 
                 self.increment_global_step()
-
-                if self.get_global_step() >= self.config.get("num_steps", float("inf")):
-                    break
             self.run_hooks(epoch_step, before=False)
             start_step = 0
 
@@ -231,53 +260,50 @@ class PyHookedModelIterator(object):
                     len(batches[split]),
                     desc=split,
                     position=pos + 1,
-                    dynamic_ncols=True,
                     leave=False,
+                    **bar_kwargs(len(batches[split]))
                 )
                 for batch_step in tqdm_iterator:
                     self._batch_step = batch_step
 
-                    active = False
-
-                    def lazy_split_op(split):
-                        def split_op():
-                            nonlocal active
-                            active = True
-                            self._split = split
-                            batch = next(batches[split])
-                            feeds = self.make_feeds(batch)
-                            fetches = step_ops
-                            self.run_hooks(
-                                batch_step,
-                                fetches,
-                                feeds,
-                                batch,
-                                before=True,
-                                epoch_hooks=True,
-                            )
-                            return self.run(fetches, feed_dict=feeds)
-
-                        return split_op
-
+                    self._split_active[split] = False
                     results = {
                         "global_step": self.get_global_step(),
-                        split: lazy_split_op(split),
+                        split: epoch_split_ops[split],
                     }
                     self.run_hooks(
                         batch_step, results=results, before=False, epoch_hooks=True
                     )
                     del results
 
-                    if batches[split].is_new_epoch or not active:
+                    if batches[split].is_new_epoch or not self._split_active[split]:
                         tqdm_iterator.update()
                         tqdm_iterator.close()
                         self.logger.info("Done with {}".format(split))
                         break
                 self.run_hooks(epoch_step, before=False, epoch_hooks=True)
 
-            if self.get_global_step() >= self.config.get("num_steps", float("inf")):
+            if self.get_global_step() >= num_steps:
                 break
 
+    def _split_op(self, batches, split, step_ops, epoch_hooks=False):
+        """Run ``step_ops`` on the next batch of ``split``. Passed to hooks as
+        lazy result of a split for the current batch step."""
+        self._split_active[split] = True
+        self._split = split
+        batch = next(batches[split])
+        feeds = self.make_feeds(batch)
+        fetches = step_ops
+        self.run_hooks(
+            self._batch_step,
+            fetches,
+            feeds,
+            batch,
+            before=True,
+            epoch_hooks=epoch_hooks,
+        )
+        return self.run(fetches, feed_dict=feeds)
+
     def run(self, fetches, feed_dict):
         """Runs all fetch ops and stores the results.
 
@@ -297,7 +323,13 @@ class PyHookedModelIterator(object):
         def fn(fetch_fn):
             return fetch_fn(self.model, **feed_dict)
 
-        results = walk(fetches, fn)
+        if not isinstance(fetches, dict):
+            return walk(fetches, fn)
+
+        # fetches are usually a flat dict of callables
+        results = dict(
+            (k, fn(v) if callable(v) else walk(v, fn)) for k, v in fetches.items()
+        )
 
         return results
 
@@ -337,24 +369,24 @@ class PyHookedModelIterator(object):
 	    Updated feeds
         """
 
-        is_step = fetches is not None and feeds is not None
-        is_step = is_step or results is not None
+        is_step = results is not None or (fetches is not None and feeds is not None)
 
-        condition = self._global_step % self.hook_freq == 0 or not is_step
+        # steps only run hooks every hook_freq steps; return early otherwise
+        if is_step and self._global_step % self.hook_freq:
+            return
 
-        hooks = self.hooks if not epoch_hooks else self.epoch_hooks
-        if condition:
-            for hook in hooks:
-                if before:
-                    if is_step:
-                        hook.before_step(index, fetches, feeds, batch)
-                    else:
-                        hook.before_epoch(index)
+        hooks = self.epoch_hooks if epoch_hooks else self.hooks
+        for hook in hooks:
+            if before:
+                if is_step:
+                    hook.before_step(index, fetches, feeds, batch)
+                else:
+                    hook.before_epoch(index)
+            else:
+                if is_step:
+                    hook.after_step(index, results)
                 else:
-                    if is_step:
-                        hook.after_step(index, results)
-                    else:
-                        hook.after_epoch(index)
+                    hook.after_epoch(index)
 
     def step_ops(self):
         """Defines ops that are called at each step.
@@ -22,6 +22,8 @@ install_full = [  # for extra functionality
     "flowiz",  # for visualizing flow with streamlit
     "wandb",  # for `--wandb_logging True`
     "tensorboard",  # for `--tensorboard_logging True`
+    "PyTurboJPEG",  # for faster decoding of CelebA images
+    "numba",  # for parallel normalization of CelebA images
 ]
 install_docs = [  # for building the documentation
     "sphinx >= 1.4",
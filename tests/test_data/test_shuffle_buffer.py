@@ -0,0 +1,65 @@
+import numpy as np
+import edflow.datasets.utils as edu
+from edflow.datasets.utils import ShuffleBuffer
+
+
+class Loader(object):
+    def __init__(self):
+        self.calls = list()
+
+    def __call__(self, i):
+        self.calls.append(i)
+        return i
+
+
+def test_chunk_order():
+    loader = Loader()
+    buffer = ShuffleBuffer(loader, 12, buffer_size=4, fetch_size=4, seed=0)
+    draws = [buffer.get() for _ in range(12)]
+
+    chunks = [loader.calls[i : i + 4] for i in range(0, 12, 4)]
+    for chunk in chunks:
+        # each fetch reads a contiguous range starting at a chunk boundary
+        assert chunk[0] % 4 == 0
+        assert chunk == list(range(chunk[0], chunk[0] + 4))
+    assert sorted(c[0] for c in chunks) == [0, 4, 8]
+    # buffer only holds one chunk, so draws follow the chunk order
+    for k, chunk in enumerate(chunks):
+        assert sorted(draws[4 * k : 4 * (k + 1)]) == chunk
+
+
+def test_bounded_buffer():
+    buffer = ShuffleBuffer(Loader(), 100, buffer_size=10, fetch_size=3, seed=0)
+    for _ in range(250):
+        buffer.get()
+        assert len(buffer._buffer) <= 10
+
+
+def test_every_index_once_per_pass():
+    length = 12
+    buffer = ShuffleBuffer(Loader(), length, buffer_size=3, fetch_size=3, seed=0)
+    draws = [buffer.get() for _ in range(3 * length)]
+    for k in range(3):
+        assert sorted(draws[k * length : (k + 1) * length]) == list(range(length))
+
+
+def test_small_dataset():
+    buffer = ShuffleBuffer(Loader(), 5, buffer_size=100, fetch_size=2, seed=0)
+    draws = [buffer.get() for _ in range(20)]
+    assert set(draws) == set(range(5))
+
+
+def test_reset_per_pid(monkeypatch):
+    def draws(pid):
+        monkeypatch.setattr(edu.os, "getpid", lambda: pid)
+        return [buffer.get() for _ in range(6)]
+
+    buffer = ShuffleBuffer(Loader(), 20, buffer_size=8, fetch_size=4, seed=0)
+    first = draws(1)
+    assert buffer._pid == 1
+    # a new process starts with an empty buffer and its own random state
+    other = draws(2)
+    assert buffer._pid == 2
+    assert other != first
+    # the same process id reproduces the same sequence
+    assert draws(1) == first
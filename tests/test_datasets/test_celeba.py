@@ -0,0 +1,142 @@
+import os, sys, subprocess
+import pytest
+import numpy as np
+from PIL import Image
+
+from edflow.datasets.celeba import CelebA
+
+
+N_IMAGES = 10
+PARTITIONS = [0, 0, 0, 0, 0, 0, 1, 1, 2, 2]
+
+
+@pytest.fixture
+def celeba_root(tmp_path, monkeypatch):
+    """Synthetic CelebA with the layout of the original files."""
+    monkeypatch.setenv("EDDATA_CACHE", str(tmp_path))
+    root = tmp_path / "CelebA"
+    (root / "img_align_celeba").mkdir(parents=True)
+    (root / "img_align_celeba.zip").touch()
+    rng = np.random.RandomState(0)
+    fnames = ["{:06d}.jpg".format(i + 1) for i in range(N_IMAGES)]
+    for fname in fnames:
+        image = rng.randint(0, 256, size=(22, 18, 3)).astype(np.uint8)
+        Image.fromarray(image).save(str(root / "img_align_celeba" / fname))
+    with open(str(root / "list_eval_partition.txt"), "w") as f:
+        for fname, partition in zip(fnames, PARTITIONS):
+            f.write("{} {}\n".format(fname, partition))
+    with open(str(root / "identity_CelebA.txt"), "w") as f:
+        for i, fname in enumerate(fnames):
+            f.write("{} {}\n".format(fname, 1000 * i + 1))
+    with open(str(root / "list_attr_celeba.txt"), "w") as f:
+        f.write("{}\nSmiling Young\n".format(N_IMAGES))
+        for i, fname in enumerate(fnames):
+            f.write("{}  {} {}\n".format(fname, 1 if i % 2 else -1, 1))
+    return root
+
+
+def test_labels(celeba_root):
+    dset = CelebA()
+    assert len(dset) == PARTITIONS.count(0)
+    assert dset.labels["fname"][0] == "img_align_celeba/000001.jpg"
+    assert dset.labels["attributes"].dtype == np.int8
+    assert dset.labels["attributes"].shape == (6, 2)
+
+    dset = CelebA({"CelebA": {"split": "test"}})
+    assert len(dset) == PARTITIONS.count(2)
+    assert list(dset.labels["identity"]) == [8001, 9001]
+
+
+@pytest.mark.parametrize(
+    "options", [dict(), dict(size=8), dict(cache_decoded=True)],
+)
+def test_get_batch(celeba_root, options):
+    dset = CelebA({"CelebA": options})
+    indices = [4, 0, 2]
+    batch = dset.get_batch(indices)
+    for k, i in enumerate(indices):
+        example = dset.get_example(i)
+        assert set(example.keys()) == set(batch.keys())
+        assert batch["fname"][k] == example["fname"]
+        for key in ["partition", "identity", "attributes", "image"]:
+            np.testing.assert_allclose(batch[key][k], example[key])
+    assert batch["image"].dtype == np.float32
+    if "size" in options:
+        assert batch["image"].shape == (3, 8, 8, 3)
+    else:
+        assert batch["image"].shape == (3, 22, 18, 3)
+
+
+def test_get_batch_empty(celeba_root):
+    with pytest.raises(ValueError):
+        CelebA().get_batch([])
+
+
+def test_cache_files(celeba_root):
+    import edflow.datasets.celeba as celeba
+
+    celeba._read_bytes_cached.cache_clear()
+    CelebA()[0]
+    assert celeba._read_bytes_cached.cache_info().currsize == 0
+
+    dset = CelebA({"CelebA": {"cache_files": True}})
+    example = dset[0]
+    assert celeba._read_bytes_cached.cache_info().currsize == 1
+    np.testing.assert_allclose(dset[0]["image"], example["image"])
+    assert celeba._read_bytes_cached.cache_info().hits == 1
+
+
+def test_parallel_normalize_kernel(tmp_path):
+    pytest.importorskip("numba")
+    env = dict(os.environ, NUMBA_CACHE_DIR=str(tmp_path))
+    x = "np.zeros((4, 3), dtype=np.uint8)"
+    # compile and cache the serial kernel first, as a loader worker would
+    subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "import numpy as np, edflow.datasets.celeba as c; "
+            "c._normalize({})".format(x),
+        ],
+        env=env,
+        check=True,
+    )
+    # the parallel kernel must not be loaded from the serial kernel's cache
+    output = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "import numpy as np, edflow.datasets.celeba as c; "
+            "c._normalize({}, parallel=True); "
+            "k = c._normalize_kernel_parallel; "
+            "print(sum(k.stats.cache_hits.values()), "
+            "len(k.get_metadata(k.signatures[0])['parfors']))".format(x),
+        ],
+        env=env,
+        check=True,
+        stdout=subprocess.PIPE,
+    )
+    cache_hits, n_parfors = output.stdout.decode().split()
+    assert cache_hits == "0"
+    assert int(n_parfors) > 0
+
+
+def test_shuffle_buffer(celeba_root):
+    config = {"CelebA": {"shuffle_buffer_size": 4, "shuffle_fetch_size": 2}}
+    dset = CelebA(config)
+    dset.append_labels = True
+    examples = [dset[0] for _ in range(len(dset))]
+    examples += dset[0:2]
+    for example in examples:
+        i = example["index_"]
+        # index_ and labels_ refer to the example drawn from the buffer
+        assert example["fname"] == dset.labels["fname"][i]
+        assert example["labels_"]["fname"] == dset.labels["fname"][i]
+        assert "buffer_index_" not in example
+    indices = sorted(example["index_"] for example in examples[: len(dset)])
+    assert indices == list(range(len(dset)))
+
+    # evaluation gets each requested example
+    dset = CelebA(dict(config, test_mode=True))
+    assert [dset[i]["index_"] for i in range(len(dset))] == list(range(len(dset)))
+    assert dset[1]["fname"] == dset.labels["fname"][1]
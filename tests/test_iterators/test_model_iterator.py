@@ -0,0 +1,157 @@
+import signal
+import pytest
+import numpy as np
+from edflow.util import walk
+from edflow.iterators.model_iterator import PyHookedModelIterator
+
+
+@pytest.fixture
+def make_iterator():
+    # the iterator installs its own signal handlers
+    handlers = {s: signal.getsignal(s) for s in [signal.SIGTERM, signal.SIGINT]}
+
+    def make(config=dict()):
+        return PyHookedModelIterator(
+            config, root=None, model=None, datasets={"train": [], "validation": []}
+        )
+
+    yield make
+    for s, handler in handlers.items():
+        signal.signal(s, handler)
+
+
+def test_make_feeds(make_iterator):
+    leaf = np.zeros(3)
+    batch = {"a": [1, leaf], "b": {"c": leaf}}
+
+    feeds = make_iterator().make_feeds(batch)
+    assert feeds == {"a": [1, leaf], "b": {"c": leaf}}
+    # containers are copied, leaves are not
+    assert feeds is not batch
+    assert feeds["a"] is not batch["a"]
+    assert feeds["b"] is not batch["b"]
+    assert feeds["b"]["c"] is leaf
+
+
+def test_run(make_iterator):
+    iterator = make_iterator()
+    iterator.model = 2
+
+    def op(model, x):
+        return model * x
+
+    fetches = {"a": op, "b": {"c": op, "d": [op]}}
+    results = iterator.run(fetches, feed_dict={"x": 3})
+    assert results == {"a": 6, "b": {"c": 6, "d": [6]}}
+
+    assert iterator.run([op, {"a": op}], feed_dict={"x": 1}) == [2, {"a": 2}]
+
+
+class Batches(object):
+    def __init__(self, n):
+        self.n = n
+        self.reset()
+
+    def __len__(self):
+        return self.n
+
+    def reset(self):
+        self.i = 0
+        self.is_new_epoch = False
+
+    def __next__(self):
+        self.i += 1
+        self.is_new_epoch = self.i >= self.n
+        return {"x": self.i}
+
+
+class StepHook(object):
+    """Pulls the training results on every step."""
+
+    def __init__(self):
+        self.steps = list()
+
+    def before_epoch(self, epoch):
+        pass
+
+    def after_epoch(self, epoch):
+        pass
+
+    def before_step(self, step, fetches, feeds, batch):
+        pass
+
+    def after_step(self, step, results):
+        self.steps.append(results["global_step"])
+        results["train"]()
+
+
+class Iterator(PyHookedModelIterator):
+    def step_ops(self):
+        return {"x": lambda model, **feeds: feeds}
+
+
+@pytest.fixture
+def make_step_iterator(make_iterator):
+    def make(num_steps):
+        make_iterator()  # saves the signal handlers
+        hook = StepHook()
+        iterator = Iterator(
+            {"num_steps": num_steps},
+            root=None,
+            model=None,
+            datasets={"train": [], "validation": []},
+            hook_freq=1,
+            hooks=[hook],
+        )
+        return iterator, hook
+
+    return make
+
+
+def test_num_steps(make_step_iterator):
+    iterator, hook = make_step_iterator(num_steps=7)
+    iterator.iterate({"train": Batches(3)})
+    assert hook.steps == list(range(7))
+    assert iterator.get_global_step() == 7
+
+
+def test_resume_after_num_steps(make_step_iterator):
+    # resuming a finished run must not run another training step
+    iterator, hook = make_step_iterator(num_steps=7)
+    iterator.set_global_step(7)
+    iterator.iterate({"train": Batches(3)})
+    assert hook.steps == list()
+    assert iterator.get_global_step() == 7
+
+
+class InplaceFeedsHook(StepHook):
+    """Converts feeds in place like :class:`ToTorchHook` and records the
+    batches seen by hooks."""
+
+    def __init__(self):
+        super().__init__()
+        self.batches = list()
+
+    def before_step(self, step, fetches, feeds, batch):
+        walk(feeds, lambda val: "converted", inplace=True)
+        self.batches.append(batch)
+
+    def after_step(self, step, results):
+        pass
+
+
+class NestedBatches(Batches):
+    def __next__(self):
+        super().__next__()
+        return {"labels": {"a": np.zeros(2)}, "list": [np.ones(2)]}
+
+
+def test_inplace_feeds_keep_batch(make_step_iterator):
+    iterator, hook = make_step_iterator(num_steps=2)
+    inplace_hook = InplaceFeedsHook()
+    iterator.hooks.insert(0, inplace_hook)
+    iterator.iterate({"train": NestedBatches(3)})
+    assert len(inplace_hook.batches) == 2
+    for batch in inplace_hook.batches:
+        assert isinstance(batch["labels"]["a"], np.ndarray)
+        assert isinstance(batch["list"][0], np.ndarray)